@@ -3,35 +3,100 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
-import json
 import torch
 import tqdm
 import speech
 import speech.loader as loader
+import speech.models as models
+
+class AcousticModel(torch.nn.Module):
+    """
+    The encoder and output layer of a CTC model, the part of inference
+    that can be compiled with TorchScript. forward mirrors Model.encode
+    followed by the output layer.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.conv = model.conv
+        self.rnn = model.rnn
+        self.fc = model.fc.fc
+        self.bidirectional = model.rnn.bidirectional
+
+    def forward(self, x):
+        x = self.conv(x.unsqueeze(1))
+        x = torch.transpose(x, 1, 2).contiguous()
+        b, t, f, c = x.size()
+        x, _ = self.rnn(x.view((b, t, f * c)))
+        if self.bidirectional:
+            half = x.size()[-1] // 2
+            x = x[:, :, :half] + x[:, :, half:]
+        return self.fc(x)
+
+def jit_model(model, input_dim):
+    """Compiles the acoustic model of a CTC model with torch.jit.script and optimize_for_inference,
+        warms it up with a dummy input and replaces model.forward_impl with the compiled version.
+
+    Returns
+    -------
+        bool, False if the model could not be compiled, in which case it is left unchanged
+    """
+    if not isinstance(model, models.CTC):
+        print("Only CTC models can be compiled, using eager mode.")
+        return False
+    dummy = torch.zeros(1, 100, input_dim)
+    if model.is_cuda:
+        dummy = dummy.cuda()
+    try:
+        acoustic = torch.jit.script(AcousticModel(model).eval())
+        acoustic = torch.jit.optimize_for_inference(acoustic)
+        with torch.inference_mode():
+            acoustic(dummy)
+    except (RuntimeError, torch.jit.frontend.FrontendError) as e:
+        print(f"Could not compile the model, using eager mode: {e}")
+        return False
+
+    def forward_impl(x, softmax=False):
+        if model.is_cuda:
+            x = x.cuda(non_blocking=True)
+        x = acoustic(x)
+        if softmax:
+            return torch.nn.functional.softmax(x, dim=2)
+        return x
+
+    model.forward_impl = forward_impl
+    return True
 
 def eval_loop(model, ldr):
     all_preds = []; all_labels = []; all_preds_dist=[]
-    for batch in tqdm.tqdm(ldr):
-        #dustin: my modification because the iteratable batch was being exhausted when it was called
-        temp_batch = list(batch)
-        preds = model.infer(temp_batch)
-        #preds_dist, prob_dist = model.infer_distribution(temp_batch, 5)
-        all_preds.extend(preds)
-        all_labels.extend(temp_batch[1])
-        #all_preds_dist.extend(((preds_dist, temp_batch[1]),prob_dist))
+    model.eval()
+    with torch.inference_mode():
+        for batch in tqdm.tqdm(ldr):
+            if model.is_cuda:
+                # the loader pins the batch so the copy overlaps with the model,
+                # pinning turns the collated tuple into a list
+                batch = [batch[0].cuda(non_blocking=True)] + list(batch[1:])
+            preds = model.infer(batch)
+            #preds_dist, prob_dist = model.infer_distribution(batch, 5)
+            all_preds.extend(preds)
+            all_labels.extend(batch[1])
+            #all_preds_dist.extend(((preds_dist, batch[1]),prob_dist))
     return list(zip(all_labels, all_preds)) #, all_preds_dist
 
 def run(model_path, dataset_json,
         batch_size=1, tag="best",
-        out_file=None):
+        out_file=None, jit=False, batch_specgram=False):
 
     use_cuda = torch.cuda.is_available()
 
     model, preproc = speech.load(model_path, tag=tag)
     ldr =  loader.make_loader(dataset_json,
-            preproc, batch_size)
+            preproc, batch_size, batch_specgram=batch_specgram,
+            device="cuda" if use_cuda else None)
     model.cuda() if use_cuda else model.cpu()
     model.set_eval()
+    if jit:
+        jit_model(model, preproc.input_dim)
 
     results = eval_loop(model, ldr)
     print(f"number of examples: {len(results)}")
@@ -47,13 +112,8 @@ def run(model_path, dataset_json,
     print("PER {:.3f}".format(cer))
 
     if out_file is not None:
-        with open(out_file, 'w') as fid:
-            for label, pred in results:
-                
-                res = {'prediction' : pred,
-                       'label' : label}
-                json.dump(res, fid)
-                fid.write("\n") 
+        loader.write_data_json([{'prediction' : pred, 'label' : label}
+                                for label, pred in results], out_file)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -67,8 +127,13 @@ if __name__ == "__main__":
         help="Last saved model instead of best on dev set.")
     parser.add_argument("--save",
         help="Optional file to save predicted results.")
+    parser.add_argument("--jit", action="store_true",
+        help="Compile the model with TorchScript for inference.")
+    parser.add_argument("--batch_specgram", action="store_true",
+        help="Compute the spectrograms of each batch with torch.stft, on the gpu if available.")
     args = parser.parse_args()
 
     run(args.model, args.dataset,
         tag=None if args.last else "best",
-        out_file=args.save)
+        out_file=args.save, jit=args.jit,
+        batch_specgram=args.batch_specgram)
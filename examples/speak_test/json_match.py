@@ -1,7 +1,6 @@
 # standard libraries
 import argparse
 import json
-import editdistance
 
 def load_phone_map():
     with open("phones.60-48-39.map", 'r') as fid:
@@ -11,8 +10,9 @@ def load_phone_map():
     m48_39 = {l[1] : l[2] for l in lines}
     return m60_48, m48_39
 
-def remap48_39(data):
-    _, m48_39 = load_phone_map()
+def remap48_39(data, m48_39=None):
+    if m48_39 is None:
+        _, m48_39 = load_phone_map()
     data = [m48_39[p] for p in data]
     return data
 
@@ -37,48 +37,32 @@ def consolidate_score(score_path: str, test_path: str, cons_path:str):
 
     with open(score_path, 'r') as score_fid:
         score_json = [json.loads(l) for l in score_fid]
-        with open(test_path, 'r') as test_fid:
-            test_json = [json.loads(l) for l in test_fid]
-
-            with open(cons_path, 'w') as fid:
-                for i in range(len(score_json)):
-                    dist = score_json[i]['dist']
-                    length = score_json[i]['label_length']
-                    per = score_json[i]['PER']
-                    label = score_json[i]['label']
-                    predi = score_json[i]['predi']
-                    #sorted(test_json, key = lambda x: x['duration'])
-
-                    match = False # if the score example and test json examples are matches, create a dictionary entry
-                    for j in range(len(test_json)):     # find the filename for the matching label
-                        
-                        if use_timit:       # if timit-flag at top of function is true
-                            #if editdistance.eval(score_json[i]['label'], remap48_39(test_json[j]['text'])) < 15 :
-                            if score_json[i]['label'] == remap48_39(test_json[j]['text']):
-                                match = True
-
-                        else: 
-                            if score_json[i]['label'] == test_json[j]['text']:
-                                match = True
-                        
-                        if match:
-                            for j in range(len(test_json)):     # find the filename for the matching label
-                                if editdistance.eval(score_json[i]['label'], remap48_39(test_json[j]['text'])) < 15 :
-                                # if score_json[i]['label'] == remap48_39(test_json[j]['text']):
-                                    filename = test_json[j]['audio']
-                                    cons_entry = {'audio': filename,
-                                                    'dist': dist, 
-                                                    'length': length,
-                                                    'PER': per,
-                                                    'label': label,
-                                                    'predi': predi}
-                                    print(cons_entry)
-                                    json.dump(cons_entry, fid)
-                                    fid.write("\n")
-
-                        match = False
-
-                            
+    with open(test_path, 'r') as test_fid:
+        test_json = [json.loads(l) for l in test_fid]
+
+    # map each label to the filename of its first example so matching a score is a single lookup
+    # the phone map is read once for all the examples
+    if use_timit:
+        _, m48_39 = load_phone_map()
+    label_to_audio = {}
+    for example in test_json:
+        text = remap48_39(example['text'], m48_39) if use_timit else example['text']
+        label_to_audio.setdefault(tuple(text), example['audio'])
+
+    with open(cons_path, 'w') as fid:
+        for score in score_json:
+            filename = label_to_audio.get(tuple(score['label']))
+            if filename is None:        # no example in the test_json has this label
+                continue
+            cons_entry = {'audio': filename,
+                            'dist': score['dist'], 
+                            'length': score['label_length'],
+                            'PER': score['PER'],
+                            'label': score['label'],
+                            'predi': score['predi']}
+            print(cons_entry)
+            json.dump(cons_entry, fid)
+            fid.write("\n")
 
 
 if __name__ == "__main__":
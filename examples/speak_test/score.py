@@ -15,19 +15,28 @@ def save_predictions(data, out_file):
                 fid.write("\n")
 
 def save_distance(data, out_file):
-    if out_file is not None:
-        with open(out_file, 'w') as fid:
-            for d in data: 
-                dist =editdistance.eval(d['label'], d['prediction'])
-                total = len(d['label'])
-                PER = dist/total
+    """writes the distance of each example to out_file and returns the total distance
+    and total label length so the PER of the set doesn't need a second pass
+    """
+    dist_sum = 0; total_sum = 0
+    fid = open(out_file, 'w') if out_file is not None else None
+    try:
+        for d in data: 
+            dist =editdistance.eval(d['label'], d['prediction'])
+            total = len(d['label'])
+            dist_sum += dist; total_sum += total
+            if fid is not None:
                 d_dict = {"predi": d['prediction'],
                           "label": d['label'], 
                           "dist" : dist,
                           "label_length": total,
-                          "PER": PER}
+                          "PER": dist/total}
                 json.dump(d_dict, fid)
                 fid.write("\n")
+    finally:
+        if fid is not None:
+            fid.close()
+    return dist_sum, total_sum
 
 
 if __name__ == "__main__":
@@ -48,10 +57,7 @@ if __name__ == "__main__":
         data = [json.loads(l) for l in fid]
 
     out_base = args.data_json.rstrip(".json")
-    save_distance(data, args.score_json)
-    dist = sum(editdistance.eval(d['label'], d['prediction'])
-                for d in data)
-    total = sum(len(d['label']) for d in data)
+    dist, total = save_distance(data, args.score_json)
 
     print("PER: {:.3f}".format(dist / total))
     
@@ -1,2 +1,2 @@
-from speech.utils.io import save, load, load_pretrained
+from speech.utils.io import save, load, load_pretrained, load_from_trained
 from speech.utils.score import compute_cer
@@ -2,10 +2,13 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import concurrent.futures
 import json
 import numpy as np
+import os
 import random
 import scipy.signal
+import threading
 import torch
 import torch.autograd as autograd
 import torch.utils.data as tud
@@ -14,6 +17,23 @@ import python_speech_features
 
 from speech.utils import wave
 
+try:
+    import numba
+except ImportError:
+    # numba is optional, the spectrogram kernels then fall back to numpy
+    numba = None
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional, the dataset jsons are then read and written with json
+    orjson = None
+
+try:
+    import pyfftw
+except ImportError:
+    # pyfftw is optional, the spectrogram ffts then use np.fft.rfft
+    pyfftw = None
 
 
 class Preprocessor():
@@ -21,7 +41,8 @@ class Preprocessor():
     END = "</s>"
     START = "<s>"
 
-    def __init__(self, data_json, max_samples=100, start_and_end=True):
+    def __init__(self, data_json, max_samples=100, start_and_end=True,
+                 data=None):
         """
         Builds a preprocessor from a dataset.
         Arguments:
@@ -30,22 +51,33 @@ class Preprocessor():
             max_samples (int): The maximum number of examples to be used
                 in computing summary statistics.
             start_and_end (bool): Include start and end tokens in labels.
+            data (list): Optional, the already parsed contents of
+                data_json, to avoid reading the file again.
 
         Note:if using mfcc processing is desired, change method log_specgram_from_file to mfcc_from_file
+        Note: the mean, std and chars are cached next to data_json (see _stats_cache_path)
+            and reused as long as data_json is not modified.
 
         """
-        data = read_data_json(data_json)
-
-        # Compute data mean, std from sample
-        audio_files = [d['audio'] for d in data]
-        random.shuffle(audio_files)
-        # the mean and std are of the log of the spectogram of the audio files
-        self.mean, self.std = compute_mean_std(audio_files[:max_samples])
+        stats = load_stats_cache(data_json, max_samples)
+        if stats is None:
+            if data is None:
+                data = read_data_json(data_json)
+
+            # Compute data mean, std from sample
+            audio_files = [d['audio'] for d in data]
+            random.shuffle(audio_files)
+            # the mean and std are of the log of the spectogram of the audio files
+            mean, std = compute_mean_std(audio_files[:max_samples])
+            chars = list(set(t for d in data for t in d['text']))
+            save_stats_cache(data_json, max_samples, mean, std, chars)
+        else:
+            mean, std, chars = stats
+
+        self.mean, self.std = mean, std
         self._input_dim = self.mean.shape[0]
 
-
         # Make char map
-        chars = list(set(t for d in data for t in d['text']))
         if start_and_end:
             # START must be last so it can easily be
             # excluded in the output classes of a model.
@@ -53,15 +85,36 @@ class Preprocessor():
         self.start_and_end = start_and_end
         self.int_to_char = dict(enumerate(chars))
         self.char_to_int = {v : k for k, v in self.int_to_char.items()}
+        self._build_lookup()
+
+    def _build_lookup(self):
+        """Builds the array versions of char_to_int and int_to_char used by encode and decode
+        """
+        chars = sorted(self.char_to_int)
+        self._c2i_keys = np.array(chars)
+        self._c2i_vals = np.array([self.char_to_int[c] for c in chars], dtype=np.int32)
+        self._i2c = np.array([self.int_to_char[i] for i in range(len(self.int_to_char))],
+                             dtype=object)
 
     def encode(self, text):
+        if not hasattr(self, "_i2c"):   # preprocessors pickled before the lookup arrays existed
+            self._build_lookup()
         text = list(text)
         if self.start_and_end:
             text = [self.START] + text + [self.END]
-        return [self.char_to_int[t] for t in text]
+        if not text:
+            return []
+        text = np.array(text)
+        idx = np.searchsorted(self._c2i_keys, text).clip(max=len(self._c2i_keys) - 1)
+        if not np.array_equal(self._c2i_keys[idx], text):
+            unknown = text[self._c2i_keys[idx] != text]
+            raise KeyError(unknown[0])
+        return self._c2i_vals[idx].tolist()
 
     def decode(self, seq):
-        text = [self.int_to_char[s] for s in seq]
+        if not hasattr(self, "_i2c"):
+            self._build_lookup()
+        text = self._i2c[np.asarray(seq, dtype=np.int64)].tolist()
         if not self.start_and_end:
             return text
 
@@ -77,6 +130,17 @@ class Preprocessor():
         targets = self.encode(text)
         return inputs, targets
 
+    def preprocess_audio(self, wave_file, text, channel=0):
+        """Same as preprocess but returns the raw waveform instead of the normalized
+            log spectrogram, which is then computed for the whole batch by SpecgramCollate
+        """
+        audio, _ = wave.array_from_wave(wave_file)
+        if len(audio.shape)>1:
+            audio = audio[:,channel]
+        inputs = torch.from_numpy(audio.astype(np.float32))
+        targets = self.encode(text)
+        return inputs, targets
+
     @property
     def input_dim(self):
         return self._input_dim
@@ -85,28 +149,92 @@ class Preprocessor():
     def vocab_size(self):
         return len(self.int_to_char)
 
-def compute_mean_std(audio_files):
-    samples = [log_specgram_from_file(af)
-                for af in audio_files]
-    samples = np.vstack(samples)
-    mean = np.mean(samples, axis=0)
-    std = np.std(samples, axis=0)
-    return mean, std
+def compute_mean_std(audio_files, num_workers=None):
+    """Computes the mean and std over all frames of the log spectrograms of audio_files
+        in a single pass without stacking the spectrograms, using Welford's update
+        generalized to the block of frames of each file.
+
+    Arguments
+    ----------
+        audio_files: list of str, the audio files to compute the statistics from
+        num_workers: int, number of processes computing the spectrograms, defaults to os.cpu_count()
+    """
+    stats = [0, None, None]     # count, mean, M2
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    if num_workers > 1 and len(audio_files) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as ex:
+            for spec in ex.map(log_specgram_from_file, audio_files, chunksize=4):
+                _welford_update(stats, spec)
+    else:
+        for af in audio_files:
+            _welford_update(stats, log_specgram_from_file(af))
+    count, mean, m2 = stats
+    std = np.sqrt(m2 / count)
+    return mean.astype(np.float32), std.astype(np.float32)
+
+def _welford_update(stats, spec):
+    """Updates the running [count, mean, M2] in stats with the frames of spec
+    """
+    spec = spec.astype(np.float64)
+    if stats[1] is None:
+        stats[1] = np.zeros(spec.shape[1]); stats[2] = np.zeros(spec.shape[1])
+    stats[0] += spec.shape[0]
+    delta = spec - stats[1]
+    stats[1] += delta.sum(axis=0) / stats[0]
+    stats[2] += (delta * (spec - stats[1])).sum(axis=0)
+
+def _stats_cache_path(data_json):
+    return data_json + ".stats.npz"
+
+def load_stats_cache(data_json, max_samples):
+    """Loads the mean, std and chars cached for data_json by save_stats_cache
+
+    Returns
+    -------
+        (mean, std, chars) tuple or None if there is no cache or data_json was
+        modified after the cache was written
+    """
+    cache_path = _stats_cache_path(data_json)
+    if not os.path.exists(cache_path):
+        return None
+    with np.load(cache_path) as cache:
+        if cache["mtime"] != os.path.getmtime(data_json) \
+                or cache["max_samples"] != max_samples:
+            return None
+        return cache["mean"], cache["std"], cache["chars"].tolist()
+
+def save_stats_cache(data_json, max_samples, mean, std, chars):
+    """Saves the mean, std and chars of data_json with the json's modification time
+    """
+    try:
+        np.savez(_stats_cache_path(data_json),
+                 mtime=os.path.getmtime(data_json),
+                 max_samples=max_samples,
+                 mean=mean, std=std,
+                 chars=np.array(chars, dtype=str))
+    except OSError:
+        # the cache is only an optimization, e.g. the dataset directory may be read-only
+        pass
 
 class AudioDataset(tud.Dataset):
 
-    def __init__(self, data_json, preproc, batch_size):
+    def __init__(self, data_json, preproc, batch_size, data=None,
+                 raw_audio=False):
 
-        data = read_data_json(data_json)        #loads the data_json into a list
+        if data is None:
+            data = read_data_json(data_json)    #loads the data_json into a list
         self.preproc = preproc                  # assign the preproc object
 
-        # I'm not fully certain what is going on here
-        bucket_diff = 4                         # number of different buckets
-        max_len = max(len(x['text']) for x in data) # max number of phoneme labels in data
-        num_buckets = max_len // bucket_diff        # the number of buckets
+        # bucket the examples by their number of spectrogram frames (10 ms each)
+        # so the examples of a batch need little padding
+        frame_bucket = 25                       # number of frames per bucket (0.25 s)
+        num_frames = lambda x : int(x['duration'] * 100)
+        max_frames = max(num_frames(x) for x in data)   # max number of frames in data
+        num_buckets = max_frames // frame_bucket + 1    # the number of buckets
         buckets = [[] for _ in range(num_buckets)]  # creating an empy list for the buckets
         for d in data:                          
-            bid = min(len(d['text']) // bucket_diff, num_buckets - 1)
+            bid = min(num_frames(d) // frame_bucket, num_buckets - 1)
             buckets[bid].append(d)
 
         # Sort by input length followed by output length
@@ -118,51 +246,124 @@ class AudioDataset(tud.Dataset):
         # unpack the data in the buckets into a list
         data = [d for b in buckets for d in b]
         self.data = data
+        # if raw_audio, the examples are waveforms to be featurized by SpecgramCollate
+        self.raw_audio = raw_audio
 
     def __len__(self):
         return len(self.data)
 
     def __getitem__(self, idx):
         datum = self.data[idx]
-        datum = self.preproc.preprocess(datum["audio"],
-                                        datum["text"])
+        preprocess = self.preproc.preprocess_audio if self.raw_audio \
+                        else self.preproc.preprocess
+        datum = preprocess(datum["audio"], datum["text"])
         return datum
 
 
+class SpecgramCollate():
+    """
+    Collates the (waveform, label) examples of AudioDataset with raw_audio=True
+    by computing the normalized log spectrograms of the whole batch at once.
+    Returns the batch in the same (inputs, labels, input_lens) format as collate.
+
+    Note: a cuda device can only be used with num_workers=0 in the DataLoader
+    """
+
+    def __init__(self, preproc, sample_rate=16000, device=None):
+        self.sample_rate = sample_rate
+        self.device = device
+        self.mean = torch.as_tensor(preproc.mean, dtype=torch.float32, device=device)
+        self.inv_std = 1.0 / torch.as_tensor(preproc.std, dtype=torch.float32, device=device)
+
+    def __call__(self, batch):
+        audios, labels = zip(*batch)
+        inputs, lens = log_specgram_batch(audios, self.sample_rate,
+                                          device=self.device)
+        inputs.sub_(self.mean).mul_(self.inv_std)
+        # zero the frames past the end of each example like zero_pad_concat
+        frames = torch.arange(inputs.shape[1], device=inputs.device)
+        inputs.masked_fill_((frames[None, :] >= lens[:, None].to(inputs.device))[:, :, None], 0.)
+        return inputs, list(labels), lens
+
+
+def collate(batch):
+    """Collates the (inputs, label) examples of AudioDataset into a zero padded float tensor
+        of shape (batch, max_time, freq), the list of labels and the tensor of input lengths
+    """
+    inputs, labels = zip(*batch)
+    lens = torch.LongTensor([x.shape[0] for x in inputs])
+    out = torch.zeros(len(inputs), int(lens.max()), inputs[0].shape[1],
+                      dtype=torch.float32)
+    for i, x in enumerate(inputs):
+        out[i, :x.shape[0]] = torch.from_numpy(x)
+    return out, list(labels), lens
+
+
 class BatchRandomSampler(tud.sampler.Sampler):
     """
     Batches the data consecutively and randomly samples
-    by batch without replacement.
+    by batch without replacement. Yields the list of indices
+    of each batch, to be used as the batch_sampler of a DataLoader.
+    The last incomplete batch is dropped.
     """
 
-    def __init__(self, data_source, batch_size):
+    def __init__(self, data_source, batch_size, seed=None):
         
         if len(data_source) < batch_size:
             raise ValueError("batch_size is greater than data length")
 
-        it_end = len(data_source) - batch_size + 1
-        self.batches = [range(i, i + batch_size)
-                for i in range(0, it_end, batch_size)]
+        # (num_batches, batch_size) array with the indices of each batch in a row
+        num_batches = len(data_source) // batch_size
+        self.batches = np.arange(num_batches * batch_size,
+                dtype=np.int64).reshape(num_batches, batch_size)
         self.data_source = data_source
+        # with no seed, shuffle with the global random state seeded by train.py
+        self.rng = random.Random(seed) if seed is not None else random
 
     def __iter__(self):
-        random.shuffle(self.batches)
-        return (i for b in self.batches for i in b)
+        order = np.random.default_rng(self.rng.getrandbits(64)).permutation(len(self.batches))
+        return iter(self.batches[order].tolist())
 
     def __len__(self):
-        return len(self.data_source)
+        return len(self.batches)
 
 def make_loader(dataset_json, preproc,
-                batch_size, num_workers=4):
+                batch_size, num_workers=None, data=None,
+                batch_specgram=False, device=None,
+                pin_memory=None):
+    """
+    If batch_specgram is True, the log spectrograms are computed per batch with torch.stft
+    on the given device by SpecgramCollate instead of per example with scipy.
+    pin_memory defaults to torch.cuda.is_available() so batches can be copied asynchronously
+    to the gpu, unless the batches are already computed on the gpu. num_workers defaults to
+    half the cpus, and at least 4. The workers are kept alive across epochs and each prefetches
+    4 batches. When the batches are computed on the gpu, cuda can't be used in forked workers,
+    so the batches are collated in the main process with num_workers=0.
+    """
+    on_gpu = batch_specgram and device is not None and torch.device(device).type == "cuda"
+    if on_gpu:
+        num_workers = 0
+    elif num_workers is None:
+        num_workers = max(4, (os.cpu_count() or 1) // 2)
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available() and not on_gpu
+    worker_kwargs = {}
+    if num_workers > 0:
+        worker_kwargs = {"persistent_workers" : True, "prefetch_factor" : 4}
     dataset = AudioDataset(dataset_json, preproc,
-                           batch_size)
+                           batch_size, data=data,
+                           raw_audio=batch_specgram)
     sampler = BatchRandomSampler(dataset, batch_size)
+    if batch_specgram:
+        collate_fn = SpecgramCollate(preproc, device=device)
+    else:
+        collate_fn = collate
     loader = tud.DataLoader(dataset,
-                batch_size=batch_size,
-                sampler=sampler,
+                batch_sampler=sampler,
                 num_workers=num_workers,
-                collate_fn=lambda batch : zip(*batch),
-                drop_last=True)
+                collate_fn=collate_fn,
+                pin_memory=pin_memory,
+                **worker_kwargs)
     return loader
 
 def mfcc_from_file(audio_file: str):
@@ -220,7 +421,7 @@ def create_mfcc(audio, sample_rate: int, esp=1e-10):
     return out.astype(np.float32)
 
 
-def log_specgram_from_file(audio_file: str, channel: int=0, plot=False):
+def log_specgram_from_file(audio_file: str, channel: int=0, plot=False, use_cache=True):
     """Computes the log of the spectrogram from from a input audio file string
 
     Arguments
@@ -228,11 +429,17 @@ def log_specgram_from_file(audio_file: str, channel: int=0, plot=False):
         audio_file: str, the filename of the audio file
         channel: int, zero-indexed optional keyword argument specifying the channel to use
         plot: bool, if true a plot of the spectrogram will be generated
+        use_cache: bool, if true the spectrogram is saved next to the audio file (see _specgram_cache_path)
+            and memory-mapped from there while it is newer than the audio file
 
     Returns
     -------
         np.ndarray, the transposed log of the spectrogram as returned by log_specgram
     """
+    cache_path = _specgram_cache_path(audio_file, channel)
+    if use_cache and not plot and os.path.exists(cache_path) \
+            and os.path.getmtime(cache_path) >= os.path.getmtime(audio_file):
+        return np.load(cache_path, mmap_mode='r')
     
     audio, sr = wave.array_from_wave(audio_file)
 
@@ -241,21 +448,196 @@ def log_specgram_from_file(audio_file: str, channel: int=0, plot=False):
         assert channel <= num_channels, "channel argument greater than audio channels"
         audio = audio[:,channel]
    
-    return log_specgram(audio, sr, plot=plot)
+    spec = log_specgram(audio, sr, plot=plot)
+    if use_cache:
+        _save_specgram_cache(cache_path, spec)
+    return spec
+
+def _specgram_cache_path(audio_file, channel=0):
+    channel = ".ch{}".format(channel) if channel else ""
+    return audio_file + channel + ".spec.npy"
+
+def _save_specgram_cache(cache_path, spec):
+    # write to a temporary file first so other processes never load a partial cache
+    tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as fid:
+            np.save(fid, spec)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # the cache is only an optimization, e.g. the audio directory may be read-only
+        # or the disk full, a partially written temporary file is removed
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
 
 def log_specgram(audio, sample_rate, window_size=20,
-                 step_size=10, eps=1e-10, plot=False):
+                 step_size=10, eps=1e-10, plot=False,
+                 mean=None, inv_std=None):
+    """Computes the log spectrogram of audio over strided float32 frames and returns it in float32.
+        The fft is computed in float32 with pyfftw, otherwise np.fft.rfft computes it in float64.
+        The output matches scipy.signal.spectrogram (hann window, 'density' scaling, no detrending).
+        With the float32 mean and inv_std per frequency, the log spectrogram is normalized
+        as (log_spec - mean) * inv_std in the same pass as the log.
+
+    Returns
+    -------
+        np.ndarray of shape (time, freq), the log of the spectrogram
+    """
     nperseg = int(window_size * sample_rate / 1e3)
     noverlap = int(step_size * sample_rate / 1e3)
-    f, t, spec = scipy.signal.spectrogram(audio,
-                    fs=sample_rate,
-                    window='hann',
-                    nperseg=nperseg,
-                    noverlap=noverlap,
-                    detrend=False)
+    hop = nperseg - noverlap
+    window, scale = _specgram_window(nperseg, sample_rate)
+
+    audio = np.asarray(audio, dtype=np.float32)
+    frames = _frame_and_window(audio, nperseg, hop, window)
+    spec = _rfft(frames)
     if plot==True:
-        plot_spectrogram(f,t, spec)
-    return np.log(spec.T.astype(np.float32) + eps)
+        f = np.fft.rfftfreq(nperseg, 1 / sample_rate)
+        t = (np.arange(spec.shape[0]) * hop + nperseg / 2) / sample_rate
+        plot_spectrogram(f, t, (np.abs(spec)**2 * scale).T)
+    log_spec = np.empty(spec.shape, dtype=np.float32)
+    return _log_magsq(spec, scale, np.float32(eps), log_spec, mean, inv_std)
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _frame_and_window(audio, nperseg, hop, window):
+        """Returns the frames of audio of size nperseg every hop samples multiplied by window,
+            audio shorter than nperseg has no frames
+        """
+        num_frames = max(0, (audio.shape[0] - nperseg) // hop + 1)
+        frames = np.empty((num_frames, nperseg), dtype=np.float32)
+        for i in numba.prange(num_frames):
+            for j in range(nperseg):
+                frames[i, j] = audio[i * hop + j] * window[j]
+        return frames
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _log_magsq(spec, scale, eps, out, mean=None, inv_std=None):
+        """Writes log(|spec|^2 * scale + eps) to out, normalized as (log - mean) * inv_std
+            when mean and inv_std are given
+        """
+        for i in numba.prange(spec.shape[0]):
+            for j in range(spec.shape[1]):
+                re = spec[i, j].real
+                im = spec[i, j].imag
+                out[i, j] = np.log((re * re + im * im) * scale[j] + eps)
+                if mean is not None:
+                    out[i, j] = (out[i, j] - mean[j]) * inv_std[j]
+        return out
+else:
+    def _frame_and_window(audio, nperseg, hop, window):
+        num_frames = max(0, (audio.shape[0] - nperseg) // hop + 1)
+        if num_frames == 0:
+            return np.empty((0, nperseg), dtype=np.float32)
+        frames = np.lib.stride_tricks.sliding_window_view(audio, nperseg)[::hop]
+        return frames * window
+
+    def _log_magsq(spec, scale, eps, out, mean=None, inv_std=None):
+        # re*re + im*im is written straight to the float32 out, without a copy of spec
+        np.multiply(spec.real, spec.real, out=out)
+        out += np.multiply(spec.imag, spec.imag, dtype=np.float32)
+        out *= scale
+        out += eps
+        np.log(out, out=out)
+        if mean is not None:
+            out -= mean
+            out *= inv_std
+        return out
+
+_specgram_windows = {}
+
+def _specgram_window(nperseg, sample_rate):
+    """Returns the float32 periodic hann window of size nperseg and the per frequency
+        scaling of scipy's one-sided 'density' spectrum, cached per (nperseg, sample_rate)
+    """
+    key = (nperseg, sample_rate)
+    if key not in _specgram_windows:
+        window = scipy.signal.get_window('hann', nperseg).astype(np.float32)
+        scale = np.full(nperseg // 2 + 1, 1.0 / (sample_rate * np.sum(window**2)),
+                        dtype=np.float32)
+        scale[1:-1 if nperseg % 2 == 0 else None] *= 2
+        _specgram_windows[key] = (window, scale)
+    return _specgram_windows[key]
+
+_FFT_BLOCK = 64     # number of frames transformed by each execution of a pyfftw plan
+_fft_plans = threading.local()
+
+def _rfft(frames):
+    """Returns the rfft of each frame of frames, of shape (num_frames, nperseg).
+        With pyfftw, the frames are transformed in blocks of _FFT_BLOCK frames by an FFTW plan
+        measured once per nperseg and per thread, so the plan is reused for any number of frames.
+    """
+    if pyfftw is None:
+        return np.fft.rfft(frames, axis=-1)
+
+    num_frames, nperseg = frames.shape
+    plans = getattr(_fft_plans, 'plans', None)
+    if plans is None:
+        plans = _fft_plans.plans = {}
+    if nperseg not in plans:
+        a = pyfftw.empty_aligned((_FFT_BLOCK, nperseg), dtype='float32')
+        b = pyfftw.empty_aligned((_FFT_BLOCK, nperseg // 2 + 1), dtype='complex64')
+        plans[nperseg] = pyfftw.FFTW(a, b, axes=(-1,),
+                                     flags=('FFTW_MEASURE', 'FFTW_DESTROY_INPUT'))
+    plan = plans[nperseg]
+
+    spec = np.empty((num_frames, nperseg // 2 + 1), dtype=np.complex64)
+    for start in range(0, num_frames, _FFT_BLOCK):
+        n = min(_FFT_BLOCK, num_frames - start)
+        plan.input_array[:n] = frames[start:start+n]
+        plan()
+        spec[start:start+n] = plan.output_array[:n]
+    return spec
+
+_hann_windows = {}
+
+def _hann_window(nperseg, device):
+    """Returns the periodic hann window (scipy's 'hann') of size nperseg, cached per device
+    """
+    key = (nperseg, str(device))
+    if key not in _hann_windows:
+        _hann_windows[key] = torch.hann_window(nperseg, device=device)
+    return _hann_windows[key]
+
+def log_specgram_batch(audios, sample_rate, window_size=20,
+                       step_size=10, eps=1e-10, device=None):
+    """Computes the log spectrograms of a batch of waveforms with a single call to torch.stft.
+        Each example matches the output of log_specgram up to float32 precision.
+
+    Arguments
+    ----------
+        audios: list of 1-d np.ndarray or torch.Tensor, the waveforms of the batch
+        sample_rate: int, the sample rate of all the waveforms
+        device: torch.device or str, the device to compute the spectrograms on
+
+    Returns
+    -------
+        torch.Tensor of shape (batch, max_frames, freq), the log spectrograms padded in time
+        torch.LongTensor of shape (batch,), the number of frames of each example
+    """
+    nperseg = int(window_size * sample_rate / 1e3)
+    noverlap = int(step_size * sample_rate / 1e3)
+    hop = nperseg - noverlap
+
+    lens = torch.LongTensor([len(a) for a in audios])
+    x = torch.zeros(len(audios), max(int(lens.max()), nperseg))
+    for i, a in enumerate(audios):
+        x[i, :len(a)] = torch.as_tensor(a, dtype=torch.float32)
+    x = x.to(device)
+
+    window = _hann_window(nperseg, x.device)
+    spec = torch.stft(x, n_fft=nperseg, hop_length=hop, window=window,
+                      center=False, return_complex=True)
+    spec = spec.abs().square_()
+    # scipy's 'density' scaling of the one-sided spectrum
+    spec.mul_(1.0 / (sample_rate * window.square().sum()))
+    spec[:, 1:-1 if nperseg % 2 == 0 else None, :].mul_(2.0)
+    spec = spec.add_(eps).log_().transpose(1, 2)
+
+    frame_lens = ((lens - nperseg) // hop + 1).clamp(min=0)
+    return spec, frame_lens
 
 
 def compare_log_spec_from_file(audio_file_1: str, audio_file_2: str, plot=False):
@@ -326,5 +708,18 @@ def plot_spectrogram(f, t, Sxx):
     plt.show()
 
 def read_data_json(data_json):
+    if orjson is not None:
+        with open(data_json, 'rb') as fid:
+            return [orjson.loads(l) for l in fid]
     with open(data_json) as fid:
         return [json.loads(l) for l in fid]
+
+def write_data_json(data, data_json):
+    """Writes each element of data as a json line of data_json in a single write
+    """
+    if orjson is not None:
+        with open(data_json, 'wb') as fid:
+            fid.write(b"".join(orjson.dumps(d) + b"\n" for d in data))
+    else:
+        with open(data_json, 'w') as fid:
+            fid.write("".join(json.dumps(d) + "\n" for d in data))
@@ -31,7 +31,7 @@ class CTC(model.Model):
             torch tensor of shape (batch x ?? x vocab_size)
         """
         if self.is_cuda:
-            x = x.cuda()
+            x = x.cuda(non_blocking=True)
         x = self.encode(x)      # propogates the data through the CNN and RNN encoder
         x = self.fc(x)          # propogates the data through a fully-connected layer
         if softmax:
@@ -40,16 +40,16 @@ class CTC(model.Model):
 
     def loss(self, batch):
         x, y, x_lens, y_lens = self.collate(*batch)
-        out = self.forward_impl(x)
+        # the warp-ctc extension only takes float32, also under autocast
+        out = self.forward_impl(x).float()
         loss_fn = ctc.CTCLoss()
         loss = loss_fn(out, y, x_lens, y_lens)
         return loss
 
-    def collate(self, inputs, labels):
-        max_t = max(i.shape[0] for i in inputs)
-        max_t = self.conv_out_size(max_t, 0)
-        x_lens = torch.IntTensor([max_t] * len(inputs))
-        x = torch.FloatTensor(model.zero_pad_concat(inputs))
+    def collate(self, inputs, labels, input_lens=None):
+        x = torch.as_tensor(model.zero_pad_concat(inputs))
+        max_t = self.conv_out_size(x.shape[1], 0)
+        x_lens = torch.IntTensor([max_t] * x.shape[0])
         y_lens = torch.IntTensor([len(l) for l in labels])
         y = torch.IntTensor([l for label in labels for l in label])
         batch = [x, y, x_lens, y_lens]
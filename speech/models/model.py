@@ -127,6 +127,22 @@ class Model(nn.Module):
         """
         raise NotImplementedError
 
+    def compile_forward(self, **kwargs):
+        """
+        Replaces forward_impl, used by forward, loss and infer, with its
+        torch.compile version when torch.compile is available. kwargs are
+        passed to torch.compile.
+        """
+        if hasattr(torch, "compile"):
+            self.forward_impl = torch.compile(self.forward_impl, **kwargs)
+
+    def __getstate__(self):
+        # a forward_impl set on the instance, by compile_forward or eval.jit_model,
+        # is not pickled, the loaded model uses the forward_impl of its class
+        state = self.__dict__.copy()
+        state.pop("forward_impl", None)
+        return state
+
     @property
     def is_cuda(self):
         return list(self.parameters())[0].is_cuda
@@ -158,8 +174,12 @@ class LinearND(nn.Module):
 def zero_pad_concat(inputs):
     """this loops over all of the examples in inputs and adds them 
     to the zero's array input_mat so that for examples with length less 
-    than the max have zero's from the end of the example until max_t
+    than the max have zero's from the end of the example until max_t.
+    If inputs is already a zero padded (batch, time, freq) tensor, as collated
+    by the loader, it is returned as is.
     """
+    if torch.is_tensor(inputs):
+        return inputs
     max_t = max(inp.shape[0] for inp in inputs)
     shape = (len(inputs), max_t, inputs[0].shape[1])
     input_mat = np.zeros(shape, dtype=np.float32)
@@ -52,7 +52,7 @@ class Seq2Seq(model.Model):
     def loss(self, batch):
         x, y = self.collate(*batch)
         if self.is_cuda:
-            x = x.cuda()
+            x = x.cuda(non_blocking=True)
             y = y.cuda()
         out, alis = self.forward_impl(x, y)
         batch_size, _, out_dim = out.size()
@@ -71,7 +71,7 @@ class Seq2Seq(model.Model):
     def forward(self, batch):
         x, y = self.collate(*batch)
         if self.is_cuda:
-            x = x.cuda()
+            x = x.cuda(non_blocking=True)
             y = y.cuda()
         return self.forward_impl(x, y)[0]
 
@@ -167,7 +167,7 @@ class Seq2Seq(model.Model):
         end_tok = y.data[0, -1] # TODO
         t = y
         if self.is_cuda:
-            x = x.cuda()
+            x = x.cuda(non_blocking=True)
             t = y.cuda()
         x = self.encode(x)
 
@@ -182,7 +182,7 @@ class Seq2Seq(model.Model):
         start_tok = y.data[0, 0]
         end_tok = y.data[0, -1] # TODO
         if self.is_cuda:
-            x = x.cuda()
+            x = x.cuda(non_blocking=True)
             y = y.cuda()
         x = self.encode(x)
 
@@ -226,10 +226,10 @@ class Seq2Seq(model.Model):
         hyp, score, _ = complete[0]
         return [hyp]
 
-    def collate(self, inputs, labels):
+    def collate(self, inputs, labels, input_lens=None):
         inputs = model.zero_pad_concat(inputs)
         labels = end_pad_concat(labels)
-        inputs = torch.from_numpy(inputs)
+        inputs = torch.as_tensor(inputs)
         labels = torch.from_numpy(labels)
         if self.volatile:
             inputs.volatile = True
@@ -37,7 +37,7 @@ class Transducer(model.Model):
 
     def forward_impl(self, x, y):
         if self.is_cuda:
-            x = x.cuda()
+            x = x.cuda(non_blocking=True)
             y = y.cuda()
         x = self.encode(x)
         out = self.decode(x, y)
@@ -46,7 +46,8 @@ class Transducer(model.Model):
     def loss(self, batch):
         x, y, x_lens, y_lens = self.collate(*batch)
         y_mat = self.label_collate(batch[1])
-        out = self.forward_impl(x, y_mat)
+        # the transducer extension only takes float32, also under autocast
+        out = self.forward_impl(x, y_mat).float()
         loss_fn = transducer.TransducerLoss()
         loss = loss_fn(out, y, x_lens, y_lens)
         return loss
@@ -76,11 +77,10 @@ class Transducer(model.Model):
         out = nn.functional.log_softmax(out, dim=3)
         return out
 
-    def collate(self, inputs, labels):
-        max_t = max(i.shape[0] for i in inputs)
-        max_t = self.conv_out_size(max_t, 0)
-        x_lens = torch.IntTensor([max_t] * len(inputs))
-        x = torch.FloatTensor(model.zero_pad_concat(inputs))
+    def collate(self, inputs, labels, input_lens=None):
+        x = torch.as_tensor(model.zero_pad_concat(inputs))
+        max_t = self.conv_out_size(x.shape[1], 0)
+        x_lens = torch.IntTensor([max_t] * x.shape[0])
         y_lens = torch.IntTensor([len(l) for l in labels])
         y = torch.IntTensor([l for label in labels for l in label])
         batch = [x, y, x_lens, y_lens]
@@ -93,7 +93,7 @@ class Transducer(model.Model):
         out = self(batch)
         out = out.cpu().data.numpy()
         preds = []
-        for e, (i, l) in enumerate(zip(*batch)):
+        for e, (i, l) in enumerate(zip(batch[0], batch[1])):
             T = i.shape[0]
             U = len(l) + 1
             lp = out[e, :T, :U, :]
@@ -1,5 +1,6 @@
 import os
 import pickle
+from collections import OrderedDict
 import torch
 
 MODEL = "model"
@@ -19,7 +20,9 @@ def save(model, preproc, path, tag=""):
 
 def load(path, tag=""):
     model_n, preproc_n = get_names(path, tag)
-    model = torch.load(model_n, map_location=torch.device('cpu'))
+    # the model is pickled as a whole, so it can't be loaded with weights_only
+    model = torch.load(model_n, map_location=torch.device('cpu'),
+                       weights_only=False)
     with open(preproc_n, 'rb') as fid:
         preproc = pickle.load(fid)
     return model, preproc
@@ -28,6 +31,43 @@ def load_pretrained(model_path):
     model = torch.load(model_path, map_location=torch.device('cpu'))
     return model
 
+def load_trained_state_dict(trained_path):
+    """
+    Returns the state_dict saved at trained_path, either on its own or in a
+    checkpoint dict under 'state_dict', both loaded with weights_only. A
+    model saved as a whole by save is unpickled and its state_dict returned.
+    """
+    try:
+        state_dict = torch.load(trained_path, map_location=torch.device('cpu'),
+                                weights_only=True)
+    except pickle.UnpicklingError:
+        model = torch.load(trained_path, map_location=torch.device('cpu'),
+                           weights_only=False)
+        return model.state_dict()
+    return state_dict.get('state_dict', state_dict)
+
+def filter_state_dict(trained_state_dict, model_state_dict):
+    """
+    Returns the entries of trained_state_dict that are in model_state_dict
+    with the same shape.
+    """
+    return OrderedDict((k, v) for k, v in trained_state_dict.items()
+                       if k in model_state_dict
+                       and v.shape == model_state_dict[k].shape)
+
+def load_from_trained(model, trained_path):
+    """
+    Initializes the parameters of model with the matching ones of the model
+    trained at trained_path, the others are left as they are.
+    Returns the names of the loaded parameters.
+    """
+    model_state_dict = model.state_dict()
+    trained = filter_state_dict(load_trained_state_dict(trained_path),
+                                model_state_dict)
+    model_state_dict.update(trained)
+    model.load_state_dict(model_state_dict)
+    return list(trained.keys())
+
 def save_dict(dct, path):
     with open(path, 'wb') as fid:
         pickle.dump(dct, fid)
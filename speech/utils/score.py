@@ -3,6 +3,9 @@ from __future__ import division
 from __future__ import print_function
 
 import editdistance
+import logging
+
+logger = logging.getLogger(__name__)
 
 def compute_cer(results):
     """
@@ -17,8 +20,20 @@ def compute_cer(results):
     ### total = 4
     >>>compute_cer(results) = 0.25      #dist/total = 1/4
     """
+    dist, total = compute_dist_total(results)
+    logger.debug("dist: %d, total: %d", dist, total)
+    return dist / total
+
+def compute_dist_total(results):
+    """
+    Arguments:
+        results (list): list of 2 elements tuples made of lists of the ground truth labels
+         and phoneme predicted sequences
+
+    Returns the summed edit distance and the total number of labels, so the PER
+    of a set can be accumulated over its batches as sum(dist) / sum(total).
+    """
     dist = sum(editdistance.eval(label, pred)
                 for label, pred in results)
     total = sum(len(label) for label, _ in results)
-    print(f"dist:{dist}, total: {total}")
-    return dist / total
+    return dist, total
@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+import torch.nn.functional as F
+
+
+def spec_augment(spec, lens=None, time_warping_para=0,
+                 frequency_masking_para=27, time_masking_para=100,
+                 frequency_mask_num=1, time_mask_num=1):
+    """Applies the time warping, frequency and time masking of SpecAugment (Park et al., 2019)
+        to a batch of spectrograms. The masks of all the examples are drawn and
+        applied at once with tensor ops, on the device of spec.
+
+    Arguments
+    ----------
+        spec: torch.Tensor of shape (batch, time, freq), as collated by the loader
+        lens: torch.Tensor of shape (batch,), optional number of frames of each example
+            so the time masks start within the example and not in its padding
+        time_warping_para: int, maximum distance a frame is moved by time_warp, 0 disables it
+        frequency_masking_para: int, maximum width of a frequency mask
+        time_masking_para: int, maximum width of a time mask
+        frequency_mask_num: int, number of frequency masks per example
+        time_mask_num: int, number of time masks per example
+
+    Returns
+    -------
+        torch.Tensor, the masked spectrograms with the same shape as spec
+    """
+    batch_size, time_dim, freq_dim = spec.shape
+    if lens is None:
+        lens = torch.full((batch_size,), time_dim, dtype=torch.long)
+    lens = lens.to(spec.device)
+
+    if time_warping_para > 0:
+        spec = time_warp(spec, lens, time_warping_para)
+
+    freq_mask = _mask(batch_size, freq_dim, frequency_mask_num,
+                      frequency_masking_para, freq_dim, spec.device)
+    time_mask = _mask(batch_size, time_dim, time_mask_num,
+                      time_masking_para, lens, spec.device)
+    keep = ~(freq_mask[:, None, :] | time_mask[:, :, None])
+    return spec * keep.to(spec.dtype)
+
+def _mask(batch_size, dim, mask_num, masking_para, lens, device):
+    """Returns a boolean tensor of shape (batch_size, dim) that is True inside
+        mask_num masks of random width in [0, masking_para] for each example
+    """
+    widths = torch.randint(0, int(masking_para) + 1,
+                           (batch_size, mask_num), device=device)
+    if not torch.is_tensor(lens):
+        lens = torch.full((batch_size,), lens, dtype=torch.long, device=device)
+    space = (lens[:, None] - widths).clamp(min=0).float()
+    starts = (torch.rand(batch_size, mask_num, device=device) * space).long()
+    idx = torch.arange(dim, device=device)[None, None, :]
+    mask = (idx >= starts[:, :, None]) & (idx < (starts + widths)[:, :, None])
+    return mask.any(dim=1)
+
+def time_warp(spec, lens=None, time_warping_para=80):
+    """Warps each spectrogram of a batch along time: a random frame at least time_warping_para
+        frames from the edges is moved by a random distance in [-time_warping_para, time_warping_para]
+        and the frames on either side of it are linearly stretched to fill the example.
+        The whole batch is resampled with a single grid_sample.
+
+    Arguments
+    ----------
+        spec: torch.Tensor of shape (batch, time, freq)
+        lens: torch.Tensor of shape (batch,), optional number of frames of each example,
+            examples shorter than 2 * time_warping_para + 1 frames are not warped
+        time_warping_para: int, maximum distance the frame is moved
+
+    Returns
+    -------
+        torch.Tensor, the warped spectrograms with the same shape as spec
+    """
+    batch_size, time_dim, freq_dim = spec.shape
+    if time_warping_para <= 0 or time_dim < 2:
+        return spec
+    device = spec.device
+    if lens is None:
+        lens = torch.full((batch_size,), time_dim, dtype=torch.long)
+    last = (lens.to(device) - 1).float()[:, None]
+    w = float(time_warping_para)
+
+    # the frame that is moved and where it is moved to
+    center = w + torch.rand(batch_size, 1, device=device) * (last - 2 * w).clamp(min=0)
+    dist = (2 * torch.rand(batch_size, 1, device=device) - 1) * w
+    dist = dist * (last > 2 * w).float()
+    dest = center + dist
+
+    # the source frame of each output frame, piecewise linear around dest
+    t = torch.arange(time_dim, device=device, dtype=torch.float32)[None, :]
+    left = t * center / dest.clamp(min=1)
+    right = center + (t - dest) * (last - center) / (last - dest).clamp(min=1)
+    src = torch.where(t < dest, left, right)
+    src = torch.where(t > last, t, src)     # leave the padding in place
+
+    grid_t = 2 * src / (time_dim - 1) - 1
+    grid_f = torch.linspace(-1, 1, freq_dim, device=device)
+    grid = torch.stack([grid_f[None, None, :].expand(batch_size, time_dim, freq_dim),
+                        grid_t[:, :, None].expand(batch_size, time_dim, freq_dim)], dim=-1)
+    warped = F.grid_sample(spec.unsqueeze(1), grid.to(spec.dtype), mode='bilinear',
+                           align_corners=True)
+    return warped.squeeze(1)
@@ -11,9 +11,9 @@ def array_from_wave(file_name):
     return audio, samp_rate
 
 def wav_duration(file_name):
-    audio, samp_rate = soundfile.read(file_name, dtype='int16')
-    nframes = audio.shape[0]
-    duration = nframes / samp_rate
+    # reads only the header, the audio doesn't need to be decoded
+    info = soundfile.info(file_name)
+    duration = info.frames / info.samplerate
 
     return duration
  
\ No newline at end of file
@@ -1,10 +1,11 @@
 # standard modules
 import argparse
+import multiprocessing as mp
+from multiprocessing import shared_memory
 import shlex
 import subprocess
 from time import sleep, time
-from queue import Queue
-from threading import Thread
+from threading import Event, Thread
 
 # third-party modules
 import torch
@@ -13,8 +14,10 @@ import soundfile
 
 # project modules
 import speech
-from speech.loader import log_specgram
+from speech.loader import log_specgram, log_specgram_batch
 
+MIC_BUFFER_SAMPLES = 256    # number of int16 samples in each 512 byte mic_buffer read by mic_record
+MIC_BUFFER_OVERLAP = 5      # the amount of overlapping mic_buffers between each audio_buffer
 
 
 """
@@ -42,14 +45,321 @@ https://github.com/mozilla/DeepSpeech/blob/v0.5.1/native_client/deepspeech.cc#L6
 
 
 
+def equal_shape_runs(arrays: list) -> list:
+    """splits arrays into lists of consecutive arrays with the same shape, except for the first
+        dimension, so each list can be batched together. In a stream only the first window is
+        shorter than the others.
+    """
+    runs = []
+    for array in arrays:
+        if runs and runs[-1][0].shape[1:] == array.shape[1:]:
+            runs[-1].append(array)
+        else:
+            runs.append([array])
+    return runs
+
+
+class AudioRingBuffer():
+    """A fixed size int16 ring buffer in shared memory that hands the mic samples from mic_record to
+        featurize_loop, which may run in another process. The samples are copied into a single
+        preallocated array instead of queuing a new object per mic_buffer, and are read in order exactly once.
+    """
+
+    def __init__(self, capacity: int):
+        ctx = mp.get_context("spawn")
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=capacity*np.dtype(np.int16).itemsize)
+        self.counts = ctx.RawArray('q', 2)  # total number of samples written and read
+        self.cond = ctx.Condition()
+        self._buffer = None
+
+    def __getstate__(self):
+        # the numpy view is recreated over the shared memory in the other process
+        state = self.__dict__.copy()
+        state['_buffer'] = None
+        return state
+
+    @property
+    def buffer(self):
+        if self._buffer is None:
+            self._buffer = np.ndarray(self.capacity, dtype=np.int16, buffer=self.shm.buf)
+        return self._buffer
+
+    @property
+    def write_count(self):
+        return self.counts[0]
+
+    @property
+    def read_count(self):
+        return self.counts[1]
+
+    def __len__(self):
+        """number of samples written and not yet read
+        """
+        return self.write_count - self.read_count
+
+    def extend(self, samples: np.ndarray):
+        """writes samples, at most capacity of them, to the buffer, if the reader falls behind by
+            more than capacity samples the oldest unread samples are overwritten
+        """
+        n = samples.shape[0]
+        with self.cond:
+            start = self.write_count % self.capacity
+            first = min(n, self.capacity - start)
+            self.buffer[start:start+first] = samples[:first]
+            self.buffer[:n-first] = samples[first:]
+            self.counts[0] += n
+            self.cond.notify()
+
+    def read_into(self, out: np.ndarray):
+        """blocks until out.shape[0] samples, at most capacity, are available and copies them into out
+        """
+        n = out.shape[0]
+        with self.cond:
+            self.cond.wait_for(lambda: len(self) >= n)
+            # skip the samples that were overwritten
+            read_count = max(self.read_count, self.write_count - self.capacity)
+            start = read_count % self.capacity
+            first = min(n, self.capacity - start)
+            out[:first] = self.buffer[start:start+first]
+            out[first:] = self.buffer[:n-first]
+            self.counts[1] = read_count + n
+
+    def unlink(self):
+        """frees the shared memory block once every process using it exits
+        """
+        self.shm.unlink()
+
+
+class SPSCRing():
+    """A single-producer single-consumer queue over a fixed ring of size slots, size a power of two.
+        put and get take no lock: only the producer advances tail and only the consumer advances head,
+        and the slot is written before tail is published. An Event is only set to wake up the other
+        thread when the ring was empty (for get) or full (for put).
+    """
+
+    def __init__(self, size: int = 64):
+        assert size > 0 and size & (size - 1) == 0, "size must be a power of two"
+        self.slots = [None] * size
+        self.mask = size - 1
+        self.head = 0   # number of items read
+        self.tail = 0   # number of items written
+        self.not_empty = Event()
+        self.not_full = Event()
+
+    def qsize(self):
+        return self.tail - self.head
+
+    def put(self, item):
+        while self.tail - self.head > self.mask:    # full
+            self.not_full.clear()
+            if self.tail - self.head <= self.mask:
+                break
+            self.not_full.wait()
+        self.slots[self.tail & self.mask] = item
+        self.tail += 1
+        if not self.not_empty.is_set():
+            self.not_empty.set()
+
+    def get(self):
+        while self.head == self.tail:               # empty
+            self.not_empty.clear()
+            if self.head != self.tail:
+                break
+            self.not_empty.wait()
+        idx = self.head & self.mask
+        item = self.slots[idx]
+        self.slots[idx] = None
+        self.head += 1
+        if not self.not_full.is_set():
+            self.not_full.set()
+        return item
+
+
+class SharedArrayRing():
+    """A single-producer single-consumer queue of numpy arrays between two processes. Each array is
+        copied into one of num_slots slots of slot_size elements in a multiprocessing.shared_memory
+        block, instead of being pickled through a pipe like with a multiprocessing.Queue.
+        The slots are handed over with a pair of semaphores counting the free and the filled slots.
+    """
+
+    def __init__(self, num_slots: int, slot_size: int, dtype, max_ndim: int = 3):
+        ctx = mp.get_context("spawn")
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.dtype = np.dtype(dtype)
+        self.max_ndim = max_ndim
+        self.shm = shared_memory.SharedMemory(create=True, size=num_slots*slot_size*self.dtype.itemsize)
+        self.shapes = ctx.RawArray('q', num_slots*(max_ndim + 1))  # ndim and shape of the array in each slot
+        self.head = ctx.RawValue('q', 0)    # number of arrays read, only advanced by the consumer
+        self.tail = ctx.RawValue('q', 0)    # number of arrays written, only advanced by the producer
+        self.free = ctx.Semaphore(num_slots)
+        self.filled = ctx.Semaphore(0)
+        self._views = None
+
+    def __getstate__(self):
+        # the numpy views are recreated over the shared memory in the other process
+        state = self.__dict__.copy()
+        state['_views'] = None
+        return state
+
+    @property
+    def views(self):
+        if self._views is None:
+            data = np.ndarray((self.num_slots, self.slot_size), dtype=self.dtype, buffer=self.shm.buf)
+            shapes = np.frombuffer(self.shapes, dtype=np.int64).reshape(self.num_slots, self.max_ndim + 1)
+            self._views = (data, shapes)
+        return self._views
+
+    def qsize(self):
+        return self.tail.value - self.head.value
+
+    def put(self, array: np.ndarray):
+        """copies array, of at most slot_size elements, into the next free slot, blocks while the ring is full
+        """
+        data, shapes = self.views
+        self.free.acquire()
+        idx = self.tail.value % self.num_slots
+        data[idx, :array.size] = array.reshape(-1)
+        shapes[idx, 0] = array.ndim
+        shapes[idx, 1:array.ndim+1] = array.shape
+        self.tail.value += 1
+        self.filled.release()
+
+    def get(self):
+        """returns a copy of the array in the oldest filled slot, blocks while the ring is empty
+        """
+        data, shapes = self.views
+        self.filled.acquire()
+        idx = self.head.value % self.num_slots
+        shape = tuple(shapes[idx, 1:shapes[idx, 0]+1])
+        array = data[idx, :int(np.prod(shape))].reshape(shape).copy()
+        self.head.value += 1
+        self.free.release()
+        return array
+
+    def unlink(self):
+        """frees the shared memory block once every process using it exits
+        """
+        self.shm.unlink()
+
+
+def featurize_loop(audio_ring, model_q, audio_buffer_size: int, mean, inv_std, max_batch: int = 8):
+    """reads the samples of the audio_ring into audio_buffers of audio_buffer_size new mic_buffers, computes
+        their normalized log spectrograms and puts them on the model_q as batches of shape (batch, time, freq)
+        Notes:
+            The audio_buffers are views of a single scratch array [tail_cache | new mic_buffers ...], each
+            one overlapping the tail_cache of the next. The audio_buffers already waiting in the audio_ring,
+            up to max_batch, are read at once.
+            With the mean and inv_std as cuda tensors the audio_buffers are featurized together on the gpu
+            with a single torch.stft call, otherwise one at a time with the fused normalization kernel.
+            Without a gpu this runs in its own process, see StreamInfer.start_featurize
+    """
+    use_cuda = torch.is_tensor(mean)
+    cache_size = 2*MIC_BUFFER_OVERLAP*MIC_BUFFER_SAMPLES      # number of samples in the tail_cache
+    step = audio_buffer_size*MIC_BUFFER_SAMPLES                # number of new samples in each audio_buffer
+    max_batch = max(1, min(max_batch, audio_ring.capacity // step))
+    scratch = np.empty(cache_size + max_batch*step, dtype=np.int16)
+    first_buffer = True
+
+    try:
+        while True:
+            # read the new mic_buffers after the tail_cache
+            num_buffers = max(1, min(max_batch, len(audio_ring) // step))
+            end = cache_size + num_buffers*step
+            audio_ring.read_into(scratch[cache_size:end])
+            audio_buffers = [scratch[i*step:i*step + cache_size + step] for i in range(num_buffers)]
+
+            # the first audio_buffer has no tail_cache, so it is featurized on its own
+            runs = [audio_buffers]
+            if first_buffer:
+                audio_buffers[0] = audio_buffers[0][cache_size:]
+                runs = [audio_buffers[:1], audio_buffers[1:]]
+                first_buffer = False
+
+            for run in runs:
+                if not run:
+                    continue
+                if use_cuda:
+                    log_spec, _ = log_specgram_batch(run, sample_rate=16000, device="cuda")
+                    log_spec.sub_(mean).mul_(inv_std)
+                    model_q.put(log_spec)
+                else:
+                    for audio_buffer in run:
+                        model_q.put(log_specgram(audio_buffer, 16000, mean=mean, inv_std=inv_std)[None])
+
+            # move the head_cache of the last audio_buffer to the tail_cache
+            scratch[:cache_size] = scratch[end-cache_size:end]
+
+    except KeyboardInterrupt:
+        print("exiting featurize_loop")
+
+
+class CUDAGraphForward():
+    """Wraps the forward_impl of a model to replay it from a cuda graph captured once per input shape.
+        The windows of a stream have a fixed size, so after the first windows every forward pass
+        is a single graph replay instead of one launch per kernel.
+        The shapes of a stream are captured before it starts by StreamInfer.capture_graphs, a shape
+        captured later is captured in thread_local error mode so the gpu work of featurize_loop in
+        another thread does not invalidate the capture.
+    """
+
+    def __init__(self, forward_impl, warmup_iters: int = 3):
+        self.forward_impl = forward_impl
+        self.warmup_iters = warmup_iters
+        self.graphs = {}    # (input shape, kwargs) -> (graph, static input, static output)
+
+    def __call__(self, x, **kwargs):
+        key = (tuple(x.shape), tuple(sorted(kwargs.items())))
+        with torch.no_grad():
+            if key not in self.graphs:
+                self.graphs[key] = self._capture(x, kwargs)
+            graph, static_in, static_out = self.graphs[key]
+            static_in.copy_(x, non_blocking=True)
+            graph.replay()
+            return static_out.clone()
+
+    def _capture(self, x, kwargs):
+        static_in = torch.empty(x.shape, dtype=x.dtype, device="cuda")
+        static_in.copy_(x)
+        # warms up, e.g. the cudnn algorithms and the torch.compile kernels, on a side stream before the capture
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(self.warmup_iters):
+                self.forward_impl(static_in, **kwargs)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph, capture_error_mode="thread_local"):
+            static_out = self.forward_impl(static_in, **kwargs)
+        return graph, static_in, static_out
+
+
 class StreamInfer():
-    def __init__(self):
-        # initializing the queues
-        self.audio_q = Queue()
-        self.preprocess_q = Queue()
-        self.model_q = Queue()
+    def __init__(self, preproc, ring_capacity: int = 2**16, queue_size: int = 64):
+        # the preprocessing object and its normalization, as float32 mean and inverse of the std
+        self.preproc = preproc
+        self._mean = preproc.mean.astype(np.float32)
+        self._inv_std = (1.0 / preproc.std).astype(np.float32)
+        if torch.cuda.is_available():
+            self._mean_cuda = torch.from_numpy(self._mean).cuda()
+            self._inv_std_cuda = torch.from_numpy(self._inv_std).cuda()
+        else:
+            # compiles, or loads from the numba cache, the normalization kernel before the stream starts
+            log_specgram(np.zeros(2*MIC_BUFFER_SAMPLES, dtype=np.int16), 16000,
+                         mean=self._mean, inv_std=self._inv_std)
+
+        # initializing the mic ring buffer, about 4 seconds of audio by default, and the queues
+        self.audio_ring = AudioRingBuffer(ring_capacity)
+        self.queue_size = queue_size
+        self.model_q = SPSCRing(queue_size)
+        self.featurize_process = None
         self.predictions = []   # a list to contain the final predictions from the ctc_decoder
-        self.audio_collection_count: int = 0    # to debug, a count of the number of audio collections created
+        # model.infer expects a 2-element batch, the batch and its fake labels are reused by every inference
+        self._fake_label = [27]
+        self._fake_labels = {}  # batch size -> tuple of fake labels
+        self._dummy_batch = [None, None]
         self.mic_put_time: float = 0.0       # to debug, sorts cummulative time to assign mic buffers
     
 
@@ -67,6 +377,8 @@ class StreamInfer():
                 Format of the the rec command: -q=quiet mode, -V0=volume factor of 0, -e signed=a signed integer encoding
                     -L=endian little, -c 1=one channel, -b 16=16 bit sample size, -r 16k=16kHZ sampele rate
                     -t raw=raw file type , - gain -2= 
+                The mic_buffer is allocated once and filled in place with readinto, the stdout pipe is unbuffered
+                so short reads are completed with further reads
         """
         
         # creates a subprocess object to record from the local mic
@@ -74,11 +386,18 @@ class StreamInfer():
         subproc = subprocess.Popen(shlex.split(subproc_args),
                             stdout=subprocess.PIPE,
                             bufsize=0)
+        mic_buffer = np.empty(MIC_BUFFER_SAMPLES, dtype=np.int16)
+        mic_bytes = memoryview(mic_buffer).cast('B')
         try:
             while True:
-                mic_buffer = subproc.stdout.read(512)
+                num_read = 0
+                while num_read < len(mic_bytes):
+                    n = subproc.stdout.readinto(mic_bytes[num_read:])
+                    if not n:
+                        raise EOFError("the rec subprocess stopped recording")
+                    num_read += n
                 put_start = time()
-                self.audio_q.put(mic_buffer)
+                self.audio_ring.extend(mic_buffer)
                 put_stop = time()
                 self.mic_put_time += (put_stop - put_start)
         
@@ -87,113 +406,116 @@ class StreamInfer():
             subproc.terminate()
             subproc.wait()
 
-    def start_collection(self, audio_buffer_size):
-
-        mic_thread = Thread(target=self.audio_collection, args=(audio_buffer_size,))
-        mic_thread.start()
-        
-    def audio_collection(self, audio_buffer_size):
-        """This function collects the number of mic_buffers specified in audio_buffer_size into 
-            a numpy array and puts it on the proprocess_q
+    def spec_shapes(self, audio_buffer_size):
+        """Returns the (time, freq) shapes of the spectrograms of the first audio_buffer,
+            which has no tail_cache, and of the next ones
         """
-        overlap = 5  # the amount of overlapping mic_buffers between each audio_buffer
-        tail_cache = np.array([], dtype=np.int16)
-        head_cache = np.array([], dtype=np.int16)
-
-        try:
-            while True:
-                # reinitialize the audio buffer to the tail_cache
-                
-                audio_buffer = tail_cache
-
-                for _ in range(audio_buffer_size - 2*overlap):
-                    audio_buffer = self.bufferq_to_numpy(audio_buffer)
-                
-                if  tail_cache.shape[0] != 0:       # the if statement avoids the first loop when the tail_cache is empty
-                    assert audio_buffer.shape[0] == (audio_buffer_size)*256, \
-                        "incorrect intermediate audio_buffer shape. expected: %i, actual %i" % (int(audio_buffer_size*256), audio_buffer.shape[0])
-                
-                for _ in range(2*overlap):
-                    head_cache = self.bufferq_to_numpy(head_cache)
-
-                assert head_cache.shape[0] == 2*overlap*256, \
-                    "incorrect head cache shape, expected: %i, actual %i" % (int(2*overlap*256), head_cache.shape[0])
-
-                audio_buffer = np.append(audio_buffer, head_cache)
-            
-                if  tail_cache.shape[0] != 0:       # the if statement avoids the first loop when the tail_cache is empty
-                    assert audio_buffer.shape[0] == (audio_buffer_size + 2*overlap)*256, \
-                        "incorrect final audio_buffer shape.  expected: %i, actual %i" % (int((audio_buffer_size + 2*overlap)*256), audio_buffer.shape[0])
-
-                # add the audio_buffer to the preprocess_q
-                self.preprocess_q.put(audio_buffer)
-                self.audio_collection_count += 1
-                tail_cache = head_cache
-                head_cache = np.array([], dtype=np.int16)   # setting head_cache back to zero
-
-
-        except KeyboardInterrupt:
-            print("exiting audio_collection")
-
-    def bufferq_to_numpy(self, audio_array: np.ndarray) -> np.ndarray:
-        """gets a mic_buffer from the audio_q, converts it to a numpy array and appends
-            it to the input audio_array
+        cache_size = 2*MIC_BUFFER_OVERLAP*MIC_BUFFER_SAMPLES
+        window_size = audio_buffer_size*MIC_BUFFER_SAMPLES + cache_size
+        return tuple(log_specgram(np.zeros(size, dtype=np.int16), sample_rate=16000).shape
+                     for size in (window_size - cache_size, window_size))
+
+    def start_featurize(self, audio_buffer_size):
+        """Creates a thread that featurizes the audio in the audio_ring with featurize_loop on the gpu.
+            Without a gpu it runs in a separate process instead, that is not serialized with the other
+            stages by the GIL, and the model_q is replaced by a ring in shared memory sized for the spectrograms
         """
-        mic_buffer = self.audio_q.get()
-        np_mic_buffer = np.frombuffer(mic_buffer, dtype=np.int16)
-        audio_array = np.append(audio_array, np_mic_buffer)
-        return audio_array
-    
-
-    def start_preprocess(self, preproc):
-
-        preprocess_thread = Thread(target=self.preprocess, args=(preproc,))
-        preprocess_thread.start()
-
-    def preprocess(self, preproc):
-        """this function gets
-
+        if torch.cuda.is_available():
+            featurize_thread = Thread(target=featurize_loop,
+                                      args=(self.audio_ring, self.model_q, audio_buffer_size,
+                                            self._mean_cuda, self._inv_std_cuda))
+            featurize_thread.start()
+        else:
+            spec_size = int(np.prod(self.spec_shapes(audio_buffer_size)[1]))
+            self.model_q = SharedArrayRing(self.queue_size, spec_size, np.float32)
+            self.featurize_process = mp.get_context("spawn").Process(
+                target=featurize_loop,
+                args=(self.audio_ring, self.model_q, audio_buffer_size, self._mean, self._inv_std),
+                daemon=True)
+            self.featurize_process.start()
+
+
+    def capture_graphs(self, model, audio_buffer_size, max_batch: int = 8):
+        """Replaces the forward_impl of the model with CUDAGraphForward and captures the graphs of the
+            first audio_buffer and of batches of 1 to max_batch audio_buffers, before start_featurize
+            runs gpu work in another thread
         """
-        try:
-            while True:
-                np_array = self.preprocess_q.get()
-                log_spec = log_specgram(np_array, sample_rate=16000)
-                norm_log_spec = (log_spec - preproc.mean) / preproc.std
-                self.model_q.put(norm_log_spec)
-        except KeyboardInterrupt:
-            print("existing preprocess")
-
-
-    def start_infer(self, model, preproc):
+        if not isinstance(model.forward_impl, CUDAGraphForward):
+            model.forward_impl = CUDAGraphForward(model.forward_impl)
+        first_shape, shape = self.spec_shapes(audio_buffer_size)
+        batch_shapes = [(1,) + first_shape] + [(b,) + shape for b in range(1, max_batch + 1)]
+        for batch_shape in batch_shapes:
+            norm_log_specs = torch.zeros(batch_shape, device="cuda")
+            model.infer((norm_log_specs, (self._fake_label,) * batch_shape[0]))
+
+    def start_infer(self, model, max_batch: int = 8):
+        """Creates a thread that runs the model on the model_q, with a gpu the forward pass
+            of the model is replayed from cuda graphs, see capture_graphs
+        """
+        if torch.cuda.is_available() and not isinstance(model.forward_impl, CUDAGraphForward):
+            model.forward_impl = CUDAGraphForward(model.forward_impl)
 
-        infer_thread = Thread(target=self.infer, args=(model, preproc))
+        infer_thread = Thread(target=self.infer, args=(model, max_batch))
         infer_thread.start()
 
-    def infer(self, model, preproc):
+    def infer(self, model, max_batch: int = 8):
+        """gets the batches of spectrograms on the model_q and adds the decoded predictions
+            of the model to the predictions list
+            Notes:
+                The batches already waiting on the model_q are concatenated and split into chunks of
+                at most max_batch windows, so the model runs on as many windows at once as possible
+                and only on the batch sizes captured by capture_graphs
+        """
 
-        # loading the model conducting inference and the preprocessing object preproc
-        fake_label = [27]
+        dummy_batch = self._dummy_batch
         try:
             while True:
-                norm_log_spec = self.model_q.get()
-                dummy_batch = ((norm_log_spec,), (fake_label,))  # model.infer expects 2-element tuple
-                preds = model.infer(dummy_batch)
-                preds = [preproc.decode(pred) for pred in preds]
-                self.predictions.extend(*preds)
-                pickel_once +=1
+                batches = [self.model_q.get()]
+                num_windows = len(batches[0])
+                while num_windows < max_batch and self.model_q.qsize() > 0:
+                    batches.append(self.model_q.get())
+                    num_windows += len(batches[-1])
+
+                for run in equal_shape_runs(batches):
+                    cat = torch.cat if torch.is_tensor(run[0]) else np.concatenate
+                    run_specs = cat(run) if len(run) > 1 else run[0]
+                    for start in range(0, len(run_specs), max_batch):
+                        norm_log_specs = run_specs[start:start+max_batch]
+                        batch_size = len(norm_log_specs)
+                        if batch_size not in self._fake_labels:
+                            self._fake_labels[batch_size] = (self._fake_label,) * batch_size
+                        dummy_batch[0] = norm_log_specs
+                        dummy_batch[1] = self._fake_labels[batch_size]
+                        preds = model.infer(dummy_batch)
+                        if self.preproc.start_and_end:
+                            for pred in preds:
+                                self.predictions.extend(self.preproc.decode(pred))
+                        else:
+                            # decode the tokens of all the windows with a single lookup
+                            self.predictions.extend(self.preproc.decode(
+                                [token for pred in preds for token in pred]))
         except KeyboardInterrupt:
             print("existing infer")
 
     
     def check_queue_size(self):
-        """Checks the size of the preprocess_q and model_q
+        """Checks the size of the audio_ring and model_q
         """
         
-        print(f"audio_q size: {self.preprocess_q.qsize()}, \
-                preprocess_q size: {self.preprocess_q.qsize()}, \
+        print(f"audio_ring size: {len(self.audio_ring)}, \
                 model_q size: {self.model_q.qsize()}, \
                 predictions length: {len(self.predictions)}")
 
+    def close(self):
+        """Stops the featurize process and frees the shared memory of the audio_ring and model_q
+        """
+        if self.featurize_process is not None:
+            self.featurize_process.terminate()
+            self.featurize_process.join()
+        self.audio_ring.unlink()
+        if isinstance(self.model_q, SharedArrayRing):
+            self.model_q.unlink()
+
 
 
 
@@ -207,19 +529,26 @@ def main(model_path: str):
 
     assert audio_buffer_size > 9, "audio_buffer size must be greater than 9"
 
-    stream_infer = StreamInfer()
+    model, preproc = speech.load(model_path, tag='')
+    model.cuda() if torch.cuda.is_available() else model.cpu()
+    model.set_eval()
+    if torch.cuda.is_available():
+        # the windows of the stream have a fixed size, so the kernels are autotuned for them,
+        # the cuda graphs are captured by StreamInfer.start_infer
+        model.compile_forward(mode="max-autotune-no-cudagraphs")
+
+    stream_infer = StreamInfer(preproc)
 
     main_start_time = time()
 
-    stream_infer.start_stream()     # collects audio from the microphone into audio buffer and puts it on the preprocess queue
-    
-    stream_infer.start_collection(audio_buffer_size)     # collects audio from the microphone into audio buffer and puts it on the preprocess queue
-    
-    model, preproc = speech.load(model_path, tag='')
+    if torch.cuda.is_available():
+        stream_infer.capture_graphs(model, audio_buffer_size)   # captures the model on the window shapes before the stream starts
 
-    stream_infer.start_preprocess(preproc)      # continually gets audio buffers from preprocess_q, preprocesses it, and puts it on the model_q
+    stream_infer.start_stream()     # collects audio from the microphone into the audio_ring
+    
+    stream_infer.start_featurize(audio_buffer_size)     # continually reads audio buffers from the audio_ring, preprocesses them, and puts them on the model_q
 
-    stream_infer.start_infer(model, preproc)     # continually getss preprocessed objects from model_q and updates the predictions list with the predictions 
+    stream_infer.start_infer(model)     # continually getss preprocessed objects from model_q and updates the predictions list with the predictions 
 
 
 
@@ -233,12 +562,13 @@ def main(model_path: str):
         #soundfile.write('new_file.wav', np_array, 16000)
         main_stop_time = time()
         time_duration = round(main_stop_time-main_start_time, 6)
-        time_collected = stream_infer.audio_collection_count*audio_buffer_size*0.016
+        time_collected = stream_infer.audio_ring.read_count / 16000
         print(f"time duration: {time_duration} sec")
         print(f"time collected: {time_collected} sec")
         print(f"time difference: {time_duration - time_collected} sec")
         print(f"mic_put_time: {stream_infer.mic_put_time} sec")
         print('All predictions:', stream_infer.predictions)
+        stream_infer.close()
 
 
 
@@ -30,6 +30,22 @@ def test_ctc_model():
     preds = model.infer(batch)
     assert len(preds) == batch_size
 
+def test_ctc_loss_autocast():
+    freq_dim = 40
+    vocab_size = 10
+
+    batch = shared.gen_fake_data(freq_dim, vocab_size)
+    model = CTC(freq_dim, vocab_size, shared.model_config)
+    device_type = "cpu"
+    if torch.cuda.is_available():
+        model.cuda()
+        device_type = "cuda"
+
+    # The bfloat16 logits are cast back to float32 for the loss
+    with torch.autocast(device_type=device_type, dtype=torch.bfloat16):
+        loss = model.loss(batch)
+    assert loss.dtype == torch.float32
+    loss.backward()
 
 def test_argmax_decode():
     blank = 0
@@ -1,7 +1,10 @@
+import os
 import tempfile
+import torch
 
 import speech.models
 import speech.loader
+import speech.utils.io
 
 import shared
 
@@ -29,3 +32,53 @@ def test_save():
         assert k in msd
     assert hasattr(s_model, 'encoder_dim')
     assert hasattr(s_model, 'is_cuda')
+
+def test_load_from_trained():
+
+    freq_dim = 120
+    trained = speech.models.Model(freq_dim, shared.model_config)
+    model = speech.models.Model(freq_dim, shared.model_config)
+
+    save_dir = tempfile.mkdtemp()
+    trained_path = os.path.join(save_dir, "state_dict")
+    torch.save(trained.state_dict(), trained_path)
+
+    loaded = speech.load_from_trained(model, trained_path)
+    assert len(loaded) == len(trained.state_dict())
+    tsd = trained.state_dict()
+    for k, v in model.state_dict().items():
+        assert torch.equal(v, tsd[k])
+
+def test_load_from_saved_model():
+
+    freq_dim = 120
+    trained = speech.models.Model(freq_dim, shared.model_config)
+    model = speech.models.Model(freq_dim, shared.model_config)
+    preproc = speech.loader.Preprocessor("test.json")
+
+    # A model pickled as a whole by save is loaded through the fallback
+    save_dir = tempfile.mkdtemp()
+    speech.save(trained, preproc, save_dir)
+    model_path, _ = speech.utils.io.get_names(save_dir, "")
+
+    loaded = speech.load_from_trained(model, model_path)
+    assert len(loaded) == len(trained.state_dict())
+    tsd = trained.state_dict()
+    for k, v in model.state_dict().items():
+        assert torch.equal(v, tsd[k])
+
+def test_filter_state_dict():
+
+    freq_dim = 120
+    model = speech.models.Model(freq_dim, shared.model_config)
+    msd = model.state_dict()
+
+    # Unknown keys and keys with a different shape are dropped
+    name = next(iter(msd))
+    trained = {name : msd[name].clone(),
+               "unknown" : torch.zeros(1)}
+    other = next(k for k in msd if k != name and msd[k].dim() > 0)
+    trained[other] = torch.zeros(msd[other].numel() + 1)
+
+    filtered = speech.utils.io.filter_state_dict(trained, msd)
+    assert list(filtered.keys()) == [name]
@@ -1,6 +1,11 @@
+import os
 import numpy as np
+import scipy.signal
+import tempfile
+import torch
 
 from speech import loader
+import speech.utils.wave as wave
 
 def test_dataset():
     batch_size = 2
@@ -31,5 +36,141 @@ def test_loader():
             batch_size, num_workers=0)
 
     # Test that batches are properly sorted by size
-    for inputs, labels in ldr:
-        assert inputs[0].shape == inputs[1].shape
+    for inputs, labels, lens in ldr:
+        assert inputs.shape[0] == batch_size
+        assert inputs.shape[2] == preproc.input_dim
+        assert lens[0] == lens[1]
+        assert len(labels) == batch_size
+
+def test_pinned_loader():
+
+    batch_size = 2
+    data_json = "test.json"
+    preproc = loader.Preprocessor(data_json)
+    ldr = loader.make_loader(data_json, preproc,
+            batch_size, num_workers=0, pin_memory=True)
+
+    # The batches are moved to the gpu like in eval.eval_loop
+    for batch in ldr:
+        inputs = batch[0]
+        if torch.cuda.is_available():
+            inputs = inputs.cuda(non_blocking=True)
+        batch = [inputs] + list(batch[1:])
+        inputs, labels, lens = batch
+        assert inputs.shape[0] == batch_size
+        assert inputs.shape[2] == preproc.input_dim
+        assert len(labels) == batch_size
+
+def test_batch_specgram_loader():
+
+    batch_size = 2
+    data_json = "test.json"
+    preproc = loader.Preprocessor(data_json)
+    device = "cuda" if torch.cuda.is_available() else None
+    ldr = loader.make_loader(data_json, preproc, batch_size,
+            num_workers=None if device else 0,
+            batch_specgram=True, device=device)
+
+    # Cuda can't be used in the workers, so the batches are collated in the main process
+    if device is not None:
+        assert ldr.num_workers == 0
+
+    for inputs, labels, lens in ldr:
+        assert inputs.shape[0] == batch_size
+        assert inputs.shape[2] == preproc.input_dim
+        assert len(labels) == batch_size
+
+def test_stats_cache():
+    data_json = "test.json"
+    preproc = loader.Preprocessor(data_json)
+    assert os.path.exists(loader._stats_cache_path(data_json))
+
+    cached = loader.Preprocessor(data_json)
+    assert np.allclose(cached.mean, preproc.mean)
+    assert np.allclose(cached.std, preproc.std)
+    assert cached.char_to_int == preproc.char_to_int
+
+def test_log_specgram_batch():
+    audio, sr = wave.array_from_wave("test0.wav")
+    short = audio[:audio.shape[0] // 2]
+    specs, lens = loader.log_specgram_batch([audio, short], sr)
+
+    for spec, n, au in zip(specs, lens, [audio, short]):
+        expected = loader.log_specgram(au, sr)
+        assert n == expected.shape[0]
+        assert np.abs(spec[:n].numpy() - expected).mean() < 1e-3
+
+def test_compute_mean_std():
+    audio_files = ["test0.wav", "test1.wav"]
+    mean, std = loader.compute_mean_std(audio_files)
+
+    samples = np.vstack([loader.log_specgram_from_file(af)
+                         for af in audio_files])
+    assert mean.dtype == np.float32
+    assert np.allclose(mean, samples.mean(axis=0), atol=1e-4)
+    assert np.allclose(std, samples.std(axis=0), atol=1e-4)
+
+def test_batch_random_sampler():
+    batch_size = 3
+    sampler = loader.BatchRandomSampler(range(10), batch_size, seed=0)
+
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 3
+    for b in batches:
+        assert b == list(range(b[0], b[0] + batch_size))
+    assert list(loader.BatchRandomSampler(range(10), batch_size, seed=0)) == batches
+
+def test_encode_decode():
+    preproc = loader.Preprocessor("test.json")
+    text = list("hello world")
+
+    ids = preproc.encode(text)
+    assert ids == [preproc.char_to_int[t]
+                   for t in [preproc.START] + text + [preproc.END]]
+    assert preproc.decode(ids) == text
+
+def test_specgram_cache():
+    spec = loader.log_specgram_from_file("test1.wav", use_cache=False)
+
+    loader.log_specgram_from_file("test1.wav")
+    assert os.path.exists(loader._specgram_cache_path("test1.wav"))
+    cached = loader.log_specgram_from_file("test1.wav")
+    assert np.allclose(cached, spec, atol=1e-4)
+
+def test_log_specgram():
+    audio, sr = wave.array_from_wave("test0.wav")
+    spec = loader.log_specgram(audio, sr)
+
+    f, t, expected = scipy.signal.spectrogram(audio, fs=sr, window='hann',
+                        nperseg=320, noverlap=160, detrend=False)
+    expected = np.log(expected.T + 1e-10)
+    assert spec.dtype == np.float32
+    assert spec.shape == expected.shape
+    assert np.abs(spec - expected).mean() < 1e-3
+
+def test_log_specgram_normalized():
+    audio, sr = wave.array_from_wave("test0.wav")
+    log_spec = loader.log_specgram(audio, sr)
+    mean = log_spec.mean(axis=0).astype(np.float32)
+    inv_std = (1.0 / log_spec.std(axis=0)).astype(np.float32)
+
+    spec = loader.log_specgram(audio, sr, mean=mean, inv_std=inv_std)
+    assert spec.dtype == np.float32
+    assert spec.shape == log_spec.shape
+    assert np.abs(spec - (log_spec - mean) * inv_std).mean() < 1e-3
+
+def test_log_specgram_short():
+    audio, sr = wave.array_from_wave("test0.wav")
+
+    # Audio shorter than a 320 sample window has no frames
+    for n in [0, 100, 200, 319]:
+        spec = loader.log_specgram(audio[:n], sr)
+        assert spec.shape == (0, 161)
+        assert spec.dtype == np.float32
+    assert loader.log_specgram(audio[:320], sr).shape == (1, 161)
+
+def test_write_data_json():
+    data = loader.read_data_json("test.json")
+    out_file = os.path.join(tempfile.mkdtemp(), "out.json")
+    loader.write_data_json(data, out_file)
+    assert loader.read_data_json(out_file) == data
@@ -5,7 +5,7 @@ model_config = {
     "dropout" : 0.0,
     "encoder" : {
         "conv" : [
-            [32, 5, 32, 2]
+            [32, 5, 32, 2, 2, 0, 0]
         ],
         "rnn" : {
             "dim" : 16,
@@ -0,0 +1,42 @@
+import torch
+
+from speech.utils.spec_augment import spec_augment, time_warp
+
+def test_spec_augment():
+    batch_size = 4
+    time_steps = 100
+    freq_dim = 40
+
+    x = torch.ones(batch_size, time_steps, freq_dim)
+    out = spec_augment(x, frequency_masking_para=10, time_masking_para=20)
+    assert out.shape == x.shape
+
+    # Masked entries are zeroed and each mask is at most the maximum width
+    assert ((out == 0) | (out == 1)).all()
+    for example in out:
+        masked_freqs = (example == 0).all(dim=0).sum()
+        masked_times = (example == 0).all(dim=1).sum()
+        assert masked_freqs <= 10
+        assert masked_times <= 20
+
+    # No masking when the masking parameters are zero
+    out = spec_augment(x, frequency_masking_para=0, time_masking_para=0)
+    assert torch.equal(out, x)
+
+def test_time_warp():
+    batch_size = 4
+    time_steps = 100
+    freq_dim = 40
+
+    x = torch.randn(batch_size, time_steps, freq_dim)
+    out = time_warp(x, time_warping_para=20)
+    assert out.shape == x.shape
+
+    # The first and last frames stay in place
+    assert torch.allclose(out[:, 0], x[:, 0], atol=1e-5)
+    assert torch.allclose(out[:, -1], x[:, -1], atol=1e-5)
+
+    # Examples too short to be warped are left unchanged
+    lens = torch.LongTensor([30] * batch_size)
+    out = time_warp(x, lens=lens, time_warping_para=20)
+    assert torch.allclose(out, x, atol=1e-5)
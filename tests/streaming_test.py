@@ -0,0 +1,107 @@
+import os
+import sys
+from threading import Thread
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import streaming
+from speech.loader import log_specgram
+
+def test_equal_shape_runs():
+    arrays = [np.zeros((1, 5, 3)), np.zeros((2, 5, 3)),
+              np.zeros((1, 4, 3)), np.zeros((1, 5, 3))]
+    runs = streaming.equal_shape_runs(arrays)
+    assert [len(run) for run in runs] == [2, 1, 1]
+    assert runs[0][1] is arrays[1]
+    assert streaming.equal_shape_runs([]) == []
+
+def test_spsc_ring():
+    ring = streaming.SPSCRing(4)
+
+    # The items come out in order while the ring wraps around
+    out = []
+    for i in range(0, 12, 3):
+        for j in range(i, i + 3):
+            ring.put(j)
+        assert ring.qsize() == 3
+        out.extend(ring.get() for _ in range(3))
+    assert out == list(range(12))
+    assert ring.qsize() == 0
+
+def test_shared_array_ring():
+    ring = streaming.SharedArrayRing(2, 12, np.float32)
+    arrays = [np.arange(6, dtype=np.float32).reshape(2, 3),
+              np.arange(4, dtype=np.float32).reshape(1, 1, 4),
+              np.arange(12, dtype=np.float32),
+              np.arange(3, dtype=np.float32).reshape(3, 1)]
+    try:
+        # The arrays keep their order and shape while the slots wrap around
+        for i in range(0, len(arrays), 2):
+            ring.put(arrays[i])
+            ring.put(arrays[i + 1])
+            assert ring.qsize() == 2
+            for array in arrays[i:i+2]:
+                out = ring.get()
+                assert out.dtype == np.float32
+                assert out.shape == array.shape
+                assert np.array_equal(out, array)
+        assert ring.qsize() == 0
+    finally:
+        ring.unlink()
+
+def test_audio_ring_buffer():
+    ring = streaming.AudioRingBuffer(8)
+    ramp = np.arange(20, dtype=np.int16)
+    try:
+        # The samples are read in order across the end of the buffer
+        out = np.empty(5, dtype=np.int16)
+        for start in range(0, 15, 5):
+            ring.extend(ramp[start:start+5])
+            ring.read_into(out)
+            assert np.array_equal(out, ramp[start:start+5])
+        assert len(ring) == 0
+
+        # A reader behind by more than capacity skips the overwritten samples
+        ring.extend(ramp[:6])
+        ring.extend(ramp[6:12])
+        out = np.empty(8, dtype=np.int16)
+        ring.read_into(out)
+        assert np.array_equal(out, ramp[4:12])
+    finally:
+        ring.unlink()
+
+def test_featurize_loop():
+    audio_buffer_size = 10
+    num_buffers = 4
+    step = audio_buffer_size * streaming.MIC_BUFFER_SAMPLES
+    cache_size = 2 * streaming.MIC_BUFFER_OVERLAP * streaming.MIC_BUFFER_SAMPLES
+
+    ring = streaming.AudioRingBuffer(2**16)
+    model_q = streaming.SPSCRing(16)
+    ramp = (np.arange(num_buffers * step) % 1000 - 500).astype(np.int16)
+    ring.extend(ramp)
+
+    freq_dim = 161
+    mean = np.zeros(freq_dim, dtype=np.float32)
+    inv_std = np.ones(freq_dim, dtype=np.float32)
+    try:
+        thread = Thread(target=streaming.featurize_loop,
+                        args=(ring, model_q, audio_buffer_size, mean, inv_std),
+                        daemon=True)
+        thread.start()
+        specs = [model_q.get() for _ in range(num_buffers)]
+    finally:
+        ring.unlink()
+
+    # The first audio_buffer has no tail_cache, the next ones start with
+    # the last cache_size samples of the previous one
+    windows = [ramp[:step]] + [ramp[i*step - cache_size:(i + 1)*step]
+                               for i in range(1, num_buffers)]
+    assert len(windows[0]) == step
+    assert all(len(w) == step + cache_size for w in windows[1:])
+    for spec, window in zip(specs, windows):
+        expected = log_specgram(window, 16000, mean=mean, inv_std=inv_std)
+        assert spec.shape == (1,) + expected.shape
+        assert np.allclose(spec[0], expected, atol=1e-4)
+    assert specs[0].shape[1] < specs[1].shape[1]
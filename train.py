@@ -15,11 +15,25 @@ import itertools
 import speech
 import speech.loader as loader
 import speech.models as models
+from speech.utils import score
+from speech.utils.spec_augment import spec_augment
 
 # TODO, (awni) why does putting this above crash..
 import tensorboard_logger as tb
 
-def run_epoch(model, optimizer, train_ldr, it, avg_loss):
+def check_nan(params):
+    """Returns True if any of the params has a nan or inf value. The params are
+    reduced with a single multi-tensor norm instead of one check per parameter.
+    """
+    if hasattr(torch, "_foreach_norm"):
+        norms = torch._foreach_norm(params)
+    else:
+        norms = [p.norm() for p in params]
+    return not torch.isfinite(torch.stack(norms)).all().item()
+
+def run_epoch(model, optimizer, train_ldr, it, avg_loss,
+              spec_augment_cfg=None, bf16=False, nan_check_iters=50,
+              log_iters=10):
     r"""This performs a forwards and backward pass through the NN
 
     Arguements
@@ -30,6 +44,17 @@ def run_epoch(model, optimizer, train_ldr, it, avg_loss):
     it: int
         the current iteration of the training model
     avg_loss
+    spec_augment_cfg: dict
+        optional keyword arguments of spec_augment, which is then applied to
+        each batch after it is moved to the gpu
+    bf16: bool
+        if True, the forward pass runs under bfloat16 autocast on the gpu,
+        the backward pass and the optimizer step stay in float32
+    nan_check_iters: int
+        the parameters are checked for nan values every nan_check_iters iterations
+    log_iters: int
+        the loss is read from the gpu and logged every log_iters iterations,
+        the other iterations don't wait on the gpu
 
     Returns
     ------------
@@ -38,21 +63,38 @@ def run_epoch(model, optimizer, train_ldr, it, avg_loss):
 
     avg_loss: 
 
+    Notes
+    ------------
+    data_time is the time spent waiting on train_ldr. The loader workers prefetch the
+    batches into pinned memory and the models copy them with non_blocking=True,
+    so it should stay near zero.
     """
     model_t = 0.0; data_t = 0.0
     end_t = time.time()
-    tq = tqdm.tqdm(train_ldr)
+    params = [p for p in model.parameters() if p.requires_grad]
+    tq = tqdm.tqdm(train_ldr, mininterval=1.0, miniters=50)
     for batch in tq:
-        temp_batch = list(batch)    # this was added as the batch object was being exhausted when it was called
+        if spec_augment_cfg is not None:
+            inputs = batch[0]
+            if model.is_cuda:
+                inputs = inputs.cuda(non_blocking=True)
+            inputs = spec_augment(inputs, lens=batch[2], **spec_augment_cfg)
+            # the batch is a list when the loader pins memory
+            batch = [inputs, batch[1], batch[2]]
         start_t = time.time()
-        optimizer.zero_grad()
-        loss = model.loss(temp_batch)
+        optimizer.zero_grad(set_to_none=True)
+        with torch.autocast(device_type='cuda', dtype=torch.bfloat16, enabled=bf16):
+            loss = model.loss(batch)
         loss.backward()
 
-        grad_norm = nn.utils.clip_grad_norm_(model.parameters(), 200)
-        loss = loss.data[0]
+        grad_norm = nn.utils.clip_grad_norm_(params, 200)
+        loss = loss.detach()
 
         optimizer.step()
+        if it % nan_check_iters == 0 and check_nan(params):
+            # the lengths come from the loader, the batch is not collated again by the model
+            print("NaN or inf in the parameters at iteration {}, input lens: {}, label lens: {}".format(
+                it, batch[2].tolist(), [len(l) for l in batch[1]]))
         prev_end_t = end_t
         end_t = time.time()
         model_t += end_t - start_t
@@ -60,33 +102,37 @@ def run_epoch(model, optimizer, train_ldr, it, avg_loss):
 
         exp_w = 0.99
         avg_loss = exp_w * avg_loss + (1 - exp_w) * loss
-        tb.log_value('train_loss', loss, it)
-        tq.set_postfix(iter=it, loss=loss,
-                avg_loss=avg_loss, grad_norm=grad_norm,
-                model_time=model_t, data_time=data_t)
+        if it % log_iters == 0:
+            loss = loss.item()
+            tb.log_value('train_loss', loss, it)
+            tq.set_postfix(iter=it, loss=loss,
+                    avg_loss=float(avg_loss), grad_norm=float(grad_norm),
+                    model_time=model_t, data_time=data_t)
         it += 1
 
-    return it, avg_loss
+    return it, float(avg_loss)
 
 def eval_dev(model, ldr, preproc):
-    losses = []; all_preds = []; all_labels = []
+    losses = []; dist = 0; total = 0
 
     model.set_eval()
 
     for batch in tqdm.tqdm(ldr):
-        temp_batch = list(batch)
-        preds = model.infer(temp_batch)
-        loss = model.loss(temp_batch)
+        preds = model.infer(batch)
+        loss = model.loss(batch)
         losses.append(loss.data[0])
-        all_preds.extend(preds)
-        all_labels.extend(temp_batch[1])        #add the labels in the batch object
+        # decodes the labels in the batch object and the predictions back to phoneme labels,
+        # the distances are accumulated so the predictions are not kept for the whole dev set
+        results = [(preproc.decode(l), preproc.decode(p))
+                   for l, p in zip(batch[1], preds)]
+        batch_dist, batch_total = score.compute_dist_total(results)
+        dist += batch_dist
+        total += batch_total
 
     model.set_train()
 
     loss = sum(losses) / len(losses)
-    results = [(preproc.decode(l), preproc.decode(p))              # decodes back to phoneme labels
-               for l, p in zip(all_labels, all_preds)]
-    cer = speech.compute_cer(results)
+    cer = dist / total
     print("Dev: Loss {:.3f}, CER {:.3f}".format(loss, cer))
     return loss, cer
 
@@ -98,31 +144,51 @@ def run(config):
 
     # Loaders
     batch_size = opt_cfg["batch_size"]
+    train_data = loader.read_data_json(data_cfg["train_set"])
     preproc = loader.Preprocessor(data_cfg["train_set"],
-                  start_and_end=data_cfg["start_and_end"])
+                  start_and_end=data_cfg["start_and_end"],
+                  data=train_data)
+    # "batch_specgram" computes the spectrograms of each batch with torch.stft,
+    # on the gpu when there is one, instead of in the loader workers
+    batch_specgram = data_cfg.get("batch_specgram", False)
+    device = "cuda" if use_cuda else None
     train_ldr = loader.make_loader(data_cfg["train_set"],
-                        preproc, batch_size)
+                        preproc, batch_size, data=train_data,
+                        batch_specgram=batch_specgram, device=device)
     dev_ldr = loader.make_loader(data_cfg["dev_set"],
-                        preproc, batch_size)
+                        preproc, batch_size,
+                        batch_specgram=batch_specgram, device=device)
 
     # Model
     model_class = eval("models." + model_cfg["class"])
     model = model_class(preproc.input_dim,
                         preproc.vocab_size,
                         model_cfg)
+    if model_cfg.get("trained_path"):
+        loaded = speech.load_from_trained(model, model_cfg["trained_path"])
+        print("Loaded {} parameters from {}".format(len(loaded), model_cfg["trained_path"]))
     model.cuda() if use_cuda else model.cpu()
+    if use_cuda and model_cfg.get("compile", True):
+        # the utterance lengths vary between batches, so compile for dynamic shapes
+        model.compile_forward(dynamic=True)
 
     # Optimizer
     optimizer = torch.optim.SGD(model.parameters(),
                     lr=opt_cfg["learning_rate"],
                     momentum=opt_cfg["momentum"])
 
+    # bfloat16 has the exponent range of float32, so no loss scaling is needed
+    bf16 = opt_cfg.get("bf16", True) and use_cuda \
+        and torch.cuda.is_bf16_supported()
+
     run_state = (0, 0)
     best_so_far = float("inf")
     for e in range(opt_cfg["epochs"]):
         start = time.time()
 
-        run_state = run_epoch(model, optimizer, train_ldr, *run_state)
+        run_state = run_epoch(model, optimizer, train_ldr, *run_state,
+                    spec_augment_cfg=data_cfg.get("spec_augment"),
+                    bf16=bf16)
 
         msg = "Epoch {} completed in {:.2f} (s)."
         print(msg.format(e, time.time() - start))